@@ -5,24 +5,294 @@ PostgreSQL 備份還原自動化測試腳本
 自動化執行不同資料大小的備份還原測試，並記錄 CPU 使用率和時間
 """
 
-import paramiko
+import socket
 import time
 import re
 import json
+import shlex
+
+try:
+    import orjson  # C 實作的編碼器，裝了就用；沒裝照舊走標準庫
+except ImportError:
+    orjson = None
+import threading
+import hashlib
+from collections import deque
+from functools import lru_cache
 from datetime import datetime
 from typing import Dict, List, Tuple
 import sys
 import argparse
+import traceback
 import getpass
 import os
+import uuid
+
+# run_remote_script 的結果標記列，格式：###KEY### value
+_MARKER_RE = re.compile(r'^###(\w+)###\s*(.*)$', re.MULTILINE)
+
+# 大小單位對應的 MB 倍率（parse_size 用）
+_SIZE_UNITS = {'GB': 1024, 'MB': 1, 'KB': 1 / 1024}
+
+# 測試總結表格的欄位定義：(標題, 寬度, 數值格式)
+# 表頭與每列格式都由這份清單導出，欄寬不會彼此走樣
+_COLS = [
+    ('資料大小', 12, ''),
+    ('資料庫大小', 12, ''),
+    ('備份時間(秒)', 14, '.2f'),
+    ('備份CPU平均(%)', 16, '.2f'),
+    ('備份CPU峰值(%)', 16, '.2f'),
+    ('備份IO平均(MB/s)', 18, '.2f'),
+    ('備份IO峰值(MB/s)', 18, '.2f'),
+    ('還原時間(秒)', 14, '.2f'),
+    ('還原CPU平均(%)', 16, '.2f'),
+    ('還原CPU峰值(%)', 16, '.2f'),
+    ('還原IO平均(MB/s)', 18, '.2f'),
+    ('還原IO峰值(MB/s)', 18, '.2f'),
+]
+_HEADER = ' '.join(f'{title:<{width}}' for title, width, _ in _COLS) + '\n'
+_ROW_FMT = ' '.join('{:<%d%s}' % (width, spec) for _, width, spec in _COLS) + '\n'
+
+# 設定檔可覆蓋 argparse 的鍵：需要整數轉型的與照原樣採用的分開列
+_INT_KEYS = ('port', 'process_max', 'archive_timeout', 'compress_level')
+_STR_KEYS = ('host', 'user', 'compress_type')
+
+
+@lru_cache(maxsize=None)
+def parse_size(size_str: str) -> int:
+    """將大小字串（如 '1GB', '500MB'）轉換為 MB；同一字串只解析一次"""
+    size_str = size_str.strip().upper()
+    for unit, multiplier in _SIZE_UNITS.items():
+        if size_str.endswith(unit):
+            return int(float(size_str[:-len(unit)]) * multiplier)
+    # 假設是數字，單位為 MB
+    return int(float(size_str))
+
+
+def calculate_scale_factor(target_mb: int) -> int:
+    """根據目標大小（MB）計算 scale factor（每個 scale factor ≈ 15 MB）"""
+    return max(1, target_mb // 15)
+
+
+def _dump_json(obj, indent: bool = False) -> str:
+    """序列化為 JSON 字串；有 orjson 時走 C 編碼器（浮點數多時快很多）"""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(obj, option=option).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+
+def _fmt_elapsed(seconds: float) -> str:
+    """把秒數格式化為「X分Y秒」"""
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes}分{secs}秒"
+
+# 遠端採樣腳本：每秒對目標進程（含子進程）採樣一次，原始輸出直接串流回本地解析，
+# 不在遠端寫任何暫存檔。優先使用 pidstat（可同時取得 CPU 與 IO）；
+# 沒有 pidstat 時直接讀 /proc/<pid>/stat（只有 CPU，tick 差值在本地計算，
+# 遠端完全不需要 fork top/awk 之類的工具）
+_MONITOR_SCRIPT = r'''
+export LC_ALL=C
+PROC="{process_name}"
+if command -v pidstat >/dev/null 2>&1; then
+    # 每秒 pgrep + 一次性 pidstat，EOS 標記一輪結束。
+    # 不用 pidstat 串流模式（單進程連跑）：非 tty 下它不保證每輪重印
+    # 標題列，本地端會沒有可靠的分輪依據
+    echo "MODE pidstat"
+    while :; do
+        pids=$(pgrep -d, -f "$PROC" 2>/dev/null)
+        if [ -z "$pids" ]; then
+            echo "EOS"
+            sleep 1
+            continue
+        fi
+        # pidstat 1 1 本身會等 1 秒，剛好就是採樣間隔
+        pidstat -h -u -d -p "$pids" 1 1 2>/dev/null
+        echo "EOS"
+    done
+fi
+echo "MODE proc $(getconf CLK_TCK 2>/dev/null || echo 100)"
+while :; do
+    pids=$(pgrep -d, -f "$PROC" 2>/dev/null)
+    if [ -z "$pids" ]; then
+        echo "EOS"
+        sleep 1
+        continue
+    fi
+    echo "T $(date +%s.%N)"
+    for p in $(echo "$pids" | tr ',' ' '); do
+        cat /proc/$p/stat 2>/dev/null
+        cat /proc/$p/io 2>/dev/null
+    done
+    echo "EOS"
+    sleep 1
+done
+'''
+
+
+class RemoteProcessMonitor:
+    """
+    透過獨立 SSH channel 串流遠端進程的 CPU / IO 採樣
+
+    遠端只負責每秒吐出原始 pidstat / top 輸出，解析與
+    平均值 / 峰值的累計都在本地執行緒完成，省去先前
+    寫 /tmp 記錄檔、事後再用 cat | awk 讀回的多次往返
+    """
+
+    def __init__(self, ssh_client, process_name: str):
+        self.process_name = process_name
+        self.cpu_samples: List[float] = []
+        self.io_samples: List[float] = []  # 單位 kB/s
+        self._started = threading.Event()  # 收到遠端第一行輸出時設置
+        self._chan = ssh_client.get_transport().open_session()
+        self._chan.exec_command(_MONITOR_SCRIPT.format(process_name=process_name))
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+
+    def wait_started(self, timeout: float = 2.0) -> bool:
+        """等待遠端採樣腳本送出第一行輸出（取代固定的暖機 sleep）"""
+        return self._started.wait(timeout)
+
+    def _reader(self):
+        mode = 'pidstat'
+        clk_tck = 100
+        col_idx = None  # (%CPU, kB_rd/s, kB_wr/s) 的欄位位置
+        sample_cpu = 0.0
+        sample_io = 0.0
+        seen_data = False
+        # proc 模式的狀態：上一輪的 {pid: ticks} / {pid: io bytes} 與時間戳
+        prev_ticks = {}
+        prev_io = {}
+        prev_time = None
+        cur_ticks = {}
+        cur_io = {}
+        cur_time = None
+        last_pid = None  # /proc/<pid>/io 的行不帶 pid，跟著前面的 stat 行
+        try:
+            for raw_line in self._chan.makefile('r'):
+                self._started.set()
+                line = raw_line.strip()
+                if not line:
+                    continue
+                if line.startswith('MODE '):
+                    parts = line.split()
+                    mode = parts[1]
+                    if mode == 'proc' and len(parts) > 2:
+                        clk_tck = int(parts[2])
+                    continue
+                if line == 'EOS':
+                    if mode == 'proc':
+                        # 用兩輪差值換算 %CPU 與 IO（只算兩輪都存在的 pid）
+                        if prev_time is not None and cur_time is not None:
+                            elapsed = cur_time - prev_time
+                            if elapsed > 0:
+                                delta = sum(cur_ticks[pid] - prev_ticks[pid]
+                                            for pid in cur_ticks
+                                            if pid in prev_ticks)
+                                sample_cpu = 100.0 * delta / clk_tck / elapsed
+                                delta_bytes = sum(
+                                    cur_io[pid] - prev_io[pid]
+                                    for pid in cur_io
+                                    if pid in prev_io and cur_io[pid] >= prev_io[pid])
+                                sample_io = delta_bytes / elapsed / 1024.0
+                                seen_data = True
+                        prev_ticks, prev_time = cur_ticks, cur_time
+                        prev_io = cur_io
+                        cur_ticks, cur_io, cur_time = {}, {}, None
+                        last_pid = None
+                    # 一輪採樣結束，把所有進程的加總收進樣本
+                    if seen_data:
+                        self.cpu_samples.append(sample_cpu)
+                        self.io_samples.append(sample_io)
+                    sample_cpu = 0.0
+                    sample_io = 0.0
+                    seen_data = False
+                    continue
+                fields = line.split()
+                if mode == 'pidstat':
+                    if line.startswith('#'):
+                        # 從標題列找欄位位置（不同 sysstat 版本欄位會位移）；
+                        # 分輪一律靠 EOS 標記，不依賴標題列出現的頻率
+                        headers = fields[1:]
+                        col_idx = tuple(
+                            headers.index(name) if name in headers else None
+                            for name in ('%CPU', 'kB_rd/s', 'kB_wr/s')
+                        )
+                        continue
+                    if col_idx and fields[0].replace('.', '', 1).isdigit():
+                        cpu_i, rd_i, wr_i = col_idx
+                        try:
+                            if cpu_i is not None:
+                                sample_cpu += float(fields[cpu_i])
+                                seen_data = True
+                            if rd_i is not None and wr_i is not None:
+                                rd = float(fields[rd_i])
+                                wr = float(fields[wr_i])
+                                # pidstat 無權限讀 IO 時會印 -1，略過
+                                if rd >= 0 and wr >= 0:
+                                    sample_io += rd + wr
+                        except (ValueError, IndexError):
+                            pass
+                else:
+                    # proc 模式：T 列帶時間戳，其餘是 /proc/<pid>/stat 和
+                    # /proc/<pid>/io 的原始內容
+                    if line.startswith('T '):
+                        try:
+                            cur_time = float(fields[1])
+                        except (ValueError, IndexError):
+                            pass
+                        continue
+                    # io 檔案的行不帶 pid，歸屬到前一個 stat 行的進程
+                    if line.startswith(('read_bytes:', 'write_bytes:')):
+                        if last_pid is not None:
+                            try:
+                                cur_io[last_pid] = (cur_io.get(last_pid, 0) +
+                                                    int(fields[1]))
+                            except (ValueError, IndexError):
+                                pass
+                        continue
+                    if ':' in fields[0]:
+                        continue  # io 檔案的其他欄位（rchar/wchar/...）
+                    # comm 欄位可能含空白，從最後一個 ')' 之後切欄位
+                    # utime/stime 是切出欄位的第 12/13 欄（0-based 11/12）
+                    paren = line.rfind(')')
+                    if paren == -1 or not fields[0].isdigit():
+                        continue
+                    rest = line[paren + 1:].split()
+                    try:
+                        last_pid = int(fields[0])
+                        cur_ticks[last_pid] = int(rest[11]) + int(rest[12])
+                    except (ValueError, IndexError):
+                        pass
+        except Exception:
+            pass  # stop() 關閉 channel 時結束執行緒
+
+    def stop(self) -> Dict:
+        """停止採樣並回傳統計（平均 / 峰值，IO 單位 kB/s）"""
+        try:
+            self._chan.close()
+        except Exception:
+            pass
+        self._thread.join(timeout=5)
+        cpu = self.cpu_samples
+        io = self.io_samples
+        return {
+            'avg_cpu': sum(cpu) / len(cpu) if cpu else 0.0,
+            'max_cpu': max(cpu) if cpu else 0.0,
+            'avg_io_kb': sum(io) / len(io) if io else 0.0,
+            'max_io_kb': max(io) if io else 0.0,
+        }
 
 class PostgreSQLTestAutomation:
-    def __init__(self, hostname: str, username: str, password: str = None, 
+    def __init__(self, hostname: str, username: str, password: str = None,
                  key_file: str = None, port: int = 22, sudo_password: str = None,
-                 process_max: int = None, archive_timeout: int = None):
+                 process_max: int = None, archive_timeout: int = None,
+                 compress_type: str = None, compress_level: int = None,
+                 known_hosts: str = None,
+                 output_file: str = "test_results.json"):
         """
         初始化 SSH 連線
-        
+
         Args:
             hostname: 遠端主機名稱或 IP
             username: SSH 使用者名稱
@@ -32,33 +302,97 @@ class PostgreSQLTestAutomation:
             sudo_password: sudo 密碼（如果未提供，則使用 SSH 密碼）
             process_max: pgbackrest 最大進程數（用於並發備份）
             archive_timeout: pgbackrest 歸檔超時時間（秒）
+            compress_type: pgbackrest 壓縮演算法（lz4 / zst 比預設 gzip 省很多 CPU）
+            compress_level: pgbackrest 壓縮等級
+            known_hosts: known_hosts 檔案路徑（提供時改用 WarningPolicy，
+                         不再自動接受未知主機金鑰）
+            output_file: JSON 報告路徑（逐筆結果即時附加到對應的 .jsonl）
         """
         self.hostname = hostname
         self.username = username
         self.sudo_password = sudo_password or password  # 如果沒指定，使用 SSH 密碼
         self.process_max = process_max
         self.archive_timeout = archive_timeout
+        self.compress_type = compress_type
+        self.compress_level = compress_level
         self.ssh_client = None
         self.results = []
         self.cpu_info = {}  # 儲存 CPU 規格資訊
+        self._pgbench_server_gen = None  # 快取 pgbench 是否支援伺服器端產生資料
+        self._sudo_ticket = False  # sudo 時間戳票證是否有效（見 _prime_sudo）
+        self._sudo_stop = threading.Event()
+        # 每完成一個測試就附加一筆到 JSONL，中途斷線 / Ctrl-C 不會丟掉已完成的結果
+        self.output_file = output_file
+        if output_file.endswith('.json'):
+            self._jsonl_path = output_file[:-len('.json')] + '.jsonl'
+        else:
+            self._jsonl_path = output_file + '.jsonl'
         
         # 建立 SSH 連線
+        # paramiko（連帶 cryptography）冷啟動要上百毫秒，等真的要連線才載入，
+        # --help / 參數錯誤這類快速結束的路徑就不用付這筆成本
+        import paramiko
+
         self.ssh_client = paramiko.SSHClient()
-        self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
+        if known_hosts:
+            # 有預先準備的 known_hosts 就不要自動接受未知金鑰
+            self.ssh_client.load_host_keys(known_hosts)
+            self.ssh_client.set_missing_host_key_policy(paramiko.WarningPolicy())
+        else:
+            self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
         try:
+            if not key_file and not password:
+                raise ValueError("必須提供 password 或 key_file")
+
+            # 自己建 socket 再交給 paramiko：
+            # - 關閉 Nagle，免去每個短命令 40~200 ms 的延遲 ACK 稅
+            #   （這個腳本每次測試要打上百個小命令）
+            # - 加大收送緩衝區，長輸出串流不被預設視窗卡住
+            sock = socket.create_connection((hostname, port), timeout=30)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 32 * 1024 * 1024)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 32 * 1024 * 1024)
+
             if key_file:
-                self.ssh_client.connect(hostname, port=port, username=username, 
-                                      key_filename=key_file, timeout=30)
-            elif password:
-                self.ssh_client.connect(hostname, port=port, username=username, 
-                                      password=password, timeout=30)
+                self.ssh_client.connect(hostname, port=port, username=username,
+                                      key_filename=key_file, timeout=30, sock=sock)
             else:
-                raise ValueError("必須提供 password 或 key_file")
+                self.ssh_client.connect(hostname, port=port, username=username,
+                                      password=password, timeout=30, sock=sock)
             print(f"✓ 成功連線到 {hostname}")
-            
+
+            # 長時間備份時 NAT / 防火牆可能悄悄斷線，設 keepalive 保住
+            # 連線（監控 channel 和持久 shell 都掛在同一條 transport 上）
+            transport = self.ssh_client.get_transport()
+            transport.set_keepalive(30)
+            # 拉大之後新開 channel 的視窗，大量輸出不會卡在預設視窗的
+            # 廣告等待；rekey 門檻調到實際上不會觸發，長時間備份
+            # 不會中途因重新金鑰交換而停頓
+            transport.default_window_size = 2 ** 27
+            transport.packetizer.REKEY_BYTES = 2 ** 40
+            transport.packetizer.REKEY_PACKETS = 2 ** 40
+
+            # 建立持久 shell channel：所有短命令共用同一個 channel，
+            # 省去每次 exec_command 開新 channel 的往返延遲
+            self._shell_lock = threading.Lock()
+            self._shell_chan = None
+            self._open_persistent_shell()
+
+            # 預先驗證 sudo，讓後續 sudo 免密碼、免重複 PAM 認證
+            self._prime_sudo()
+
             # 獲取系統 CPU 規格資訊
             self.cpu_info = self.get_cpu_info()
+
+            # 記錄遠端核心數（一次性探測），process_max 未指定時據此自動決定
+            nproc_stdout, _, _ = self.execute_command("nproc", timeout=10)
+            try:
+                self.remote_cores = int(nproc_stdout.strip())
+            except ValueError:
+                logical_cpus = self.cpu_info.get('logical_cpus')
+                self.remote_cores = logical_cpus if isinstance(logical_cpus, int) else 1
+
             if self.cpu_info:
                 print(f"✓ 系統 CPU 規格: {self.cpu_info.get('model_name', '未知')}")
                 print(f"  CPU 核心數: {self.cpu_info.get('cpu_cores', '未知')}")
@@ -67,112 +401,315 @@ class PostgreSQLTestAutomation:
             print(f"✗ SSH 連線失敗: {e}")
             sys.exit(1)
     
-    def execute_command(self, command: str, timeout: int = 300) -> Tuple[str, str, int]:
+    def _open_persistent_shell(self):
+        """建立（或重建）持久 shell channel"""
+        try:
+            self._shell_chan = self.ssh_client.invoke_shell(width=1024)
+            self._shell_chan.settimeout(10)
+            time.sleep(0.3)
+            self._drain_shell()
+        except Exception as e:
+            print(f"⚠ 無法建立持久 shell channel，將逐一使用 exec_command: {e}")
+            self._shell_chan = None
+
+    def _drain_shell(self):
+        """清掉 channel 上殘留的輸出（登入訊息、提示字元等）"""
+        while self._shell_chan.recv_ready():
+            self._shell_chan.recv(65536)
+
+    def _execute_on_shell(self, command: str, timeout: int) -> Tuple[str, str, int]:
+        """
+        在持久 shell channel 上執行命令，以 __RC_<code>__ 標記判斷命令結束
+
+        Returns:
+            (stdout, stderr, exit_code)；pty 上 stderr 會併入 stdout
+        """
+        with self._shell_lock:
+            self._drain_shell()
+            # 每個命令用獨一無二的結束標記，命令輸出剛好包含固定標記
+            # 字樣也不會被誤判成結束（printf 的 %d 由遠端展開為退出碼）
+            token = uuid.uuid4().hex[:12]
+            end_marker_re = re.compile(r'__RC_(\d+)_' + token + r'__')
+            # sendall：Channel.send 可能只送出部分位元組，截斷的命令會
+            # 留半截在 shell 上掛到逾時為止
+            self._shell_chan.sendall(
+                (command + "; printf '\\n__RC_%d_" + token + "__\\n' $?\n").encode('utf-8'))
+            buffer = ""
+            deadline = time.time() + timeout
+            while True:
+                if self._shell_chan.recv_ready():
+                    buffer += self._shell_chan.recv(65536).decode('utf-8', errors='ignore')
+                    match = end_marker_re.search(buffer)
+                    if match:
+                        output = buffer[:match.start()]
+                        # 去掉 pty 回顯的命令本身（第一行）
+                        if '\n' in output:
+                            output = output.split('\n', 1)[1]
+                        else:
+                            output = ""
+                        return output, "", int(match.group(1))
+                elif time.time() > deadline:
+                    raise TimeoutError(f"持久 shell 執行逾時: {command[:80]}")
+                else:
+                    time.sleep(0.02)
+
+    def execute_command(self, command: str, timeout: int = 300,
+                        persistent: bool = True,
+                        stdin_data: str = None) -> Tuple[str, str, int]:
         """
         執行遠端命令
-        
+
+        短命令預設走持久 shell channel（一次 SSH 交握服務所有命令）；
+        長時間執行且需要同時監控的命令應傳 persistent=False，
+        讓它使用獨立 channel，監控才能並行。
+        stdin_data 會直接寫進命令的標準輸入（例如 sudo -S 的密碼，
+        不經過遠端 argv，ps 上看不到），並強制使用獨立 channel。
+
         Returns:
             (stdout, stderr, exit_code)
+
+        Raises:
+            TimeoutError: 命令在 timeout 內沒有結束（不會自動重跑）
         """
+        if stdin_data is not None:
+            persistent = False
+        if persistent and self._shell_chan is not None:
+            try:
+                return self._execute_on_shell(command, timeout)
+            except TimeoutError:
+                # 逾時代表命令太慢，不是通道壞掉：命令還在遠端 shell 上跑，
+                # 先關掉舊 channel（讓 shell 收到 SIGHUP 終止遺留命令）再重建，
+                # 但絕不退回 exec_command 重跑，否則同一個命令會同時跑兩份
+                try:
+                    self._shell_chan.close()
+                except Exception:
+                    pass
+                self._open_persistent_shell()
+                raise
+            except Exception:
+                # channel 真的損壞（斷線等）時重建，並退回 exec_command
+                self._open_persistent_shell()
         try:
-            stdin, stdout, stderr = self.ssh_client.exec_command(command, timeout=timeout)
-            exit_code = stdout.channel.recv_exit_status()
-            stdout_text = stdout.read().decode('utf-8', errors='ignore')
-            stderr_text = stderr.read().decode('utf-8', errors='ignore')
-            return stdout_text, stderr_text, exit_code
+            chan = self.ssh_client.get_transport().open_session()
+            chan.exec_command(command)
+            if stdin_data is not None:
+                chan.sendall(stdin_data.encode('utf-8'))
+                chan.shutdown_write()
+            # 分塊接收並只保留尾端 500 字元：pgbench / pgbackrest 的大量
+            # 進度輸出不會整段先堆進記憶體再被截斷
+            stdout_tail = deque(maxlen=500)
+            stderr_tail = deque(maxlen=500)
+            deadline = time.time() + timeout
+            while True:
+                received = False
+                if chan.recv_ready():
+                    stdout_tail.extend(chan.recv(65536).decode('utf-8', errors='ignore'))
+                    received = True
+                if chan.recv_stderr_ready():
+                    stderr_tail.extend(chan.recv_stderr(65536).decode('utf-8', errors='ignore'))
+                    received = True
+                if not received:
+                    if chan.exit_status_ready():
+                        break
+                    if time.time() > deadline:
+                        chan.close()
+                        raise TimeoutError(f"命令執行逾時: {command[:80]}")
+                    time.sleep(0.05)
+            # 結束後把還在途中的輸出收完
+            while chan.recv_ready():
+                stdout_tail.extend(chan.recv(65536).decode('utf-8', errors='ignore'))
+            while chan.recv_stderr_ready():
+                stderr_tail.extend(chan.recv_stderr(65536).decode('utf-8', errors='ignore'))
+            exit_code = chan.recv_exit_status()
+            return ''.join(stdout_tail), ''.join(stderr_tail), exit_code
         except Exception as e:
             return "", str(e), -1
     
-    def execute_sudo_command(self, command: str, timeout: int = 300) -> Tuple[str, str, int]:
+    def _prime_sudo(self):
         """
-        執行需要 sudo 的命令（使用 sudo -S 從標準輸入讀取密碼）
-        
+        用 sudo -v 先驗證一次取得時間戳票證，之後所有 sudo 改用 -n
+        免密碼執行，省掉每次管道密碼 + PAM 認證的開銷；背景執行緒
+        每 60 秒刷新票證以免過期。如果 sudoers 啟用 tty_tickets
+        （票證綁定 tty，-n 在 exec channel 上會失敗），維持舊的
+        逐次管道密碼路徑
+        """
+        if self.sudo_password:
+            # 密碼從 stdin 餵給 sudo -S，不進遠端 argv（ps 上看不到）
+            self.execute_command("sudo -S -p '' -v 2>/dev/null",
+                                 stdin_data=self.sudo_password + "\n")
+        else:
+            self.execute_command("sudo -n -v 2>/dev/null")
+        # 用獨立 channel（無 tty）驗證票證是否全域有效
+        _, _, exit_code = self.execute_command("sudo -n true 2>/dev/null",
+                                               timeout=30, persistent=False)
+        self._sudo_ticket = (exit_code == 0)
+        if self._sudo_ticket:
+            keepalive = threading.Thread(target=self._sudo_keepalive_loop, daemon=True)
+            keepalive.start()
+
+    def _sudo_keepalive_loop(self):
+        """背景刷新 sudo 票證（預設 5 分鐘過期，每 60 秒刷新一次）"""
+        while not self._sudo_stop.wait(60):
+            try:
+                _, _, exit_code = self.execute_command("sudo -n -v 2>/dev/null",
+                                                       timeout=30)
+            except TimeoutError:
+                # 刷新逾時視同刷新失敗，不能讓執行緒帶著有效票證死掉
+                exit_code = 1
+            if exit_code != 0:
+                # 票證失效，讓 execute_sudo_command 退回管道密碼路徑
+                self._sudo_ticket = False
+                break
+
+    def execute_sudo_command(self, command: str, timeout: int = 300,
+                             persistent: bool = True) -> Tuple[str, str, int]:
+        """
+        執行需要 sudo 的命令
+
+        票證有效時直接 sudo -n；否則使用 sudo -S 從標準輸入讀取密碼
+
         Returns:
             (stdout, stderr, exit_code)
         """
+        if self._sudo_ticket:
+            return self.execute_command(f"sudo -n {command}", timeout,
+                                        persistent=persistent)
         if self.sudo_password:
-            # 轉義特殊字元，使用單引號包圍密碼
-            # 將單引號轉義為 '\''
-            escaped_password = self.sudo_password.replace("'", "'\"'\"'")
-            # 使用 echo 將密碼傳給 sudo -S
-            full_command = f"echo '{escaped_password}' | sudo -S {command}"
-        else:
-            # 如果沒有提供 sudo 密碼，嘗試直接執行（可能已配置 NOPASSWD）
-            full_command = f"sudo {command}"
-        
-        return self.execute_command(full_command, timeout)
+            # 密碼從 stdin 餵給 sudo -S，不進遠端 argv
+            return self.execute_command(f"sudo -S -p '' {command}", timeout,
+                                        stdin_data=self.sudo_password + "\n")
+        # 如果沒有提供 sudo 密碼，嘗試直接執行（可能已配置 NOPASSWD）
+        return self.execute_command(f"sudo {command}", timeout, persistent=persistent)
     
+    def run_remote_script(self, script: str, timeout: int = 300,
+                          sudo: bool = False) -> Dict[str, str]:
+        """
+        把多個相依的 shell 步驟合併成一次 SSH 往返執行
+
+        腳本內以 `echo "###KEY### value"` 標記各步驟結果，
+        本地解析標記後回傳字典，省去逐步驟開 channel 的延遲
+
+        Returns:
+            {key: value}
+        """
+        quoted_script = shlex.quote(script)
+        stdin_data = None
+        if sudo:
+            if self._sudo_ticket:
+                command = f"sudo -n bash -c {quoted_script}"
+            elif self.sudo_password:
+                command = f"sudo -S -p '' bash -c {quoted_script}"
+                stdin_data = self.sudo_password + "\n"
+            else:
+                command = f"sudo bash -c {quoted_script}"
+        else:
+            command = f"bash -c {quoted_script}"
+
+        stdout, stderr, exit_code = self.execute_command(command, timeout,
+                                                         stdin_data=stdin_data)
+        return {match.group(1): match.group(2).strip()
+                for match in _MARKER_RE.finditer(stdout)}
+
+    def _effective_process_max(self) -> int:
+        """
+        實際使用的 pgbackrest process-max
+
+        未指定時依遠端核心數自動決定，保守取 min(核心數, 8)，
+        避免過度並行反而互搶 IO
+        """
+        if self.process_max:
+            return self.process_max
+        return max(1, min(self.remote_cores, 8))
+
+    def _pgbench_server_side_generate(self) -> bool:
+        """
+        pgbench 13+ 的 -I 步驟支援大寫 G：資料直接在伺服器端產生，
+        不用逐列經過 client 連線送進去
+
+        第一次呼叫時遠端查一次版本並快取
+        """
+        if self._pgbench_server_gen is None:
+            stdout, _, exit_code = self.execute_command("pgbench --version")
+            # 鎖定「pgbench (PostgreSQL) 16.2」括號後的主版號，
+            # 不讓輸出裡其他零星數字先被比對到
+            match = re.search(r'\)\s+(\d+)', stdout) if exit_code == 0 else None
+            self._pgbench_server_gen = bool(match and int(match.group(1)) >= 13)
+        return self._pgbench_server_gen
+
+    def _wait_until(self, probe_cmd: str, timeout: float = 30,
+                    interval: float = 0.2) -> bool:
+        """
+        輪詢 probe_cmd 直到退出碼為 0 或逾時
+
+        取代步驟間固定的 time.sleep()：只等實際需要的時間
+
+        Returns:
+            True 表示條件在時限內成立
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                _, _, exit_code = self.execute_command(probe_cmd, timeout=10)
+            except TimeoutError:
+                # 探測逾時當作條件尚未成立，繼續輪詢到外層時限為止
+                exit_code = 1
+            if exit_code == 0:
+                return True
+            time.sleep(interval)
+        return False
+
     def get_cpu_info(self) -> Dict:
         """
         獲取系統 CPU 規格資訊
-        
+
+        五個探測命令合併成一個遠端腳本，啟動探測只需一趟 SSH 往返
+
         Returns:
             包含 CPU 資訊的字典
         """
+        probe_script = '\n'.join([
+            'echo "###MODEL### $(grep -m1 \'model name\' /proc/cpuinfo'
+            ' | cut -d: -f2- | sed \'s/^[[:space:]]*//\')"',
+            'echo "###LOGICAL### $(grep -c \'^processor\' /proc/cpuinfo)"',
+            'echo "###LSCPU### $(lscpu 2>/dev/null | grep \'^CPU(s):\' | awk \'{print $2}\')"',
+            'echo "###CORES_PER_SOCKET### $(grep -m1 \'cpu cores\' /proc/cpuinfo | awk \'{print $4}\')"',
+            'echo "###SOCKETS### $(grep \'physical id\' /proc/cpuinfo | sort -u | wc -l)"',
+        ])
+        markers = self.run_remote_script(probe_script, timeout=30)
+
         cpu_info = {}
-        
+
         # 獲取 CPU 型號
-        model_cmd = "grep 'model name' /proc/cpuinfo | head -1 | cut -d: -f2 | sed 's/^[[:space:]]*//'"
-        model_stdout, _, _ = self.execute_command(model_cmd, timeout=10)
-        if model_stdout.strip():
-            cpu_info['model_name'] = model_stdout.strip()
-        
-        # 獲取物理 CPU 核心數
-        cores_cmd = "grep -c '^processor' /proc/cpuinfo"
-        cores_stdout, _, _ = self.execute_command(cores_cmd, timeout=10)
+        if markers.get('MODEL'):
+            cpu_info['model_name'] = markers['MODEL']
+
+        # 獲取邏輯 CPU 數
         try:
-            logical_cpus = int(cores_stdout.strip())
-            cpu_info['logical_cpus'] = logical_cpus
-        except:
+            cpu_info['logical_cpus'] = int(markers.get('LOGICAL', ''))
+        except ValueError:
             cpu_info['logical_cpus'] = '未知'
-        
-        # 獲取物理核心數（如果有超線程，邏輯 CPU = 物理核心 * 2）
-        physical_cores_cmd = "lscpu 2>/dev/null | grep '^CPU(s):' | awk '{print $2}'"
-        physical_cores_stdout, _, _ = self.execute_command(physical_cores_cmd, timeout=10)
-        if physical_cores_stdout.strip():
+
+        # 獲取物理核心數：優先 lscpu，其次 cpu cores × sockets
+        try:
+            cpu_info['cpu_cores'] = int(markers.get('LSCPU', ''))
+        except ValueError:
+            pass
+        if 'cpu_cores' not in cpu_info:
             try:
-                cpu_info['cpu_cores'] = int(physical_cores_stdout.strip())
-            except:
+                cpu_info['cpu_cores'] = (int(markers.get('CORES_PER_SOCKET', '')) *
+                                         int(markers.get('SOCKETS', '')))
+            except ValueError:
                 pass
-        
-        # 如果沒有獲取到物理核心數，嘗試其他方法
-        if 'cpu_cores' not in cpu_info or cpu_info['cpu_cores'] == '未知':
-            # 嘗試從 /proc/cpuinfo 獲取
-            cores_cmd = "grep 'cpu cores' /proc/cpuinfo | head -1 | awk '{print $4}'"
-            cores_stdout, _, _ = self.execute_command(cores_cmd, timeout=10)
-            if cores_stdout.strip():
-                try:
-                    cores_per_socket = int(cores_stdout.strip())
-                    sockets_cmd = "grep 'physical id' /proc/cpuinfo | sort -u | wc -l"
-                    sockets_stdout, _, _ = self.execute_command(sockets_cmd, timeout=10)
-                    if sockets_stdout.strip():
-                        sockets = int(sockets_stdout.strip())
-                        cpu_info['cpu_cores'] = cores_per_socket * sockets
-                except:
-                    pass
-        
-        # 如果還是沒有，使用邏輯 CPU 數作為估算
-        if 'cpu_cores' not in cpu_info or cpu_info['cpu_cores'] == '未知':
-            if 'logical_cpus' in cpu_info and isinstance(cpu_info['logical_cpus'], int):
-                # 假設有超線程，物理核心 = 邏輯 CPU / 2
+
+        # 如果還是沒有，使用邏輯 CPU 數估算（假設有超線程）
+        if 'cpu_cores' not in cpu_info:
+            if isinstance(cpu_info.get('logical_cpus'), int):
                 cpu_info['cpu_cores'] = cpu_info['logical_cpus'] // 2
             else:
                 cpu_info['cpu_cores'] = '未知'
-        
+
         return cpu_info
-    
-    def get_cpu_usage(self) -> float:
-        """
-        獲取當前 CPU 使用率（使用 top 命令）
-        """
-        command = "top -bn1 | grep 'Cpu(s)' | sed 's/.*, *\\([0-9.]*\\)%* id.*/\\1/' | awk '{print 100 - $1}'"
-        stdout, stderr, exit_code = self.execute_command(command, timeout=10)
-        try:
-            cpu_usage = float(stdout.strip())
-            return cpu_usage
-        except:
-            return 0.0
-    
+
     def monitor_command_with_cpu(self, command: str, description: str) -> Dict:
         """
         執行命令並監控 CPU 使用率、IO 使用率和時間
@@ -190,336 +727,50 @@ class PostgreSQLTestAutomation:
             process_name = "pgbench"
         elif "pgbackrest" in command:
             process_name = "pgbackrest"
-        
-        # 創建監控腳本，監控特定進程及其子進程
-        # 使用普通字符串，然後替換 PROCESS_NAME，避免 f-string 的變量轉義問題
-        monitor_script = """#!/bin/bash
-CPU_LOG=/tmp/cpu_monitor_$$.log
-IO_LOG=/tmp/io_monitor_$$.log
-PROCESS_NAME="{PROCESS_NAME}"
-
-# 函數：獲取指定進程的所有 PID（包括子進程）
-get_process_pids() {{
-    local main_pids=$(pgrep -f "$PROCESS_NAME" 2>/dev/null)
-    local all_pids=""
-    
-    if [ -z "$main_pids" ]; then
-        echo ""
-        return 0
-    fi
-    
-    for pid in $main_pids; do
-        if [ ! -d "/proc/$pid" ]; then
-            continue
-        fi
-        all_pids="$all_pids $pid"
-        
-        # 獲取該進程的直接子進程
-        if command -v pgrep >/dev/null 2>&1; then
-            local children=$(pgrep -P $pid 2>/dev/null)
-            if [ -n "$children" ]; then
-                all_pids="$all_pids $children"
-                # 遞歸查找子進程的子進程（最多2層）
-                for child in $children; do
-                    if [ -d "/proc/$child" ]; then
-                        local grandchildren=$(pgrep -P $child 2>/dev/null)
-                        if [ -n "$grandchildren" ]; then
-                            all_pids="$all_pids $grandchildren"
-                        fi
-                    fi
-                done
-            fi
-        fi
-    done
-    
-    # 去重並輸出
-    echo "$all_pids" | tr ' ' '\\n' | sort -un | grep -v '^$' | tr '\\n' ' '
-}}
-
-# CPU 監控進程 - 監控特定進程的 CPU 使用率
-(
-    while true; do
-        pids=$(get_process_pids)
-        if [ -n "$pids" ]; then
-            total_cpu=0
-            cpu_count=0
-            
-            # 使用 pidstat 監控特定進程（如果可用，最準確）
-            if command -v pidstat >/dev/null 2>&1; then
-                for pid in $pids; do
-                    if [ -d "/proc/$pid" ]; then
-                        # pidstat -p PID 1 1 表示監控1秒，輸出1次
-                        # 跳過標題行（前3行通常是標題），獲取數據行
-                        pidstat_output=$(pidstat -p $pid 1 1 2>/dev/null)
-                        if [ -n "$pidstat_output" ]; then
-                            # 找到包含 PID 的數據行（跳過標題）
-                            cpu_line=$(echo "$pidstat_output" | tail -n +4 | grep "^[[:space:]]*$pid[[:space:]]" | head -1)
-                            if [ -z "$cpu_line" ]; then
-                                # 如果沒找到，嘗試最後一行（可能是數據行）
-                                cpu_line=$(echo "$pidstat_output" | tail -1)
-                            fi
-                            if [ -n "$cpu_line" ] && ! echo "$cpu_line" | grep -qE '^[[:space:]]*PID|Linux|^$'; then
-                                # %CPU 通常在第 8 列，如果沒有則嘗試第 7 列
-                                cpu=$(echo "$cpu_line" | awk '{{print $8}}' 2>/dev/null)
-                                if [ -z "$cpu" ] || ! echo "$cpu" | grep -qE '^[0-9]+\\.?[0-9]*$'; then
-                                    cpu=$(echo "$cpu_line" | awk '{{print $7}}' 2>/dev/null)
-                                fi
-                                # 驗證是數字
-                                if [ -n "$cpu" ] && echo "$cpu" | grep -qE '^[0-9]+\\.?[0-9]*$'; then
-                                    # 使用 awk 進行浮點數加法
-                                    if [ -z "$total_cpu" ] || [ "$total_cpu" = "0" ]; then
-                                        total_cpu="$cpu"
-                                    else
-                                        total_cpu=$(echo "$total_cpu $cpu" | awk '{{printf "%.2f", $1 + $2}}' 2>/dev/null)
-                                    fi
-                                    if [ $? -eq 0 ] && [ -n "$total_cpu" ]; then
-                                        cpu_count=$((cpu_count + 1))
-                                    fi
-                                fi
-                            fi
-                        fi
-                    fi
-                done
-            else
-                # 使用 top 監控特定進程
-                for pid in $pids; do
-                    if [ -d "/proc/$pid" ]; then
-                        cpu_line=$(top -bn1 -p $pid 2>/dev/null | tail -1)
-                        if [ -n "$cpu_line" ]; then
-                            cpu=$(echo "$cpu_line" | awk '{{print $9}}' 2>/dev/null)
-                            # 驗證是數字（可能是整數或小數）
-                            if [ -n "$cpu" ] && echo "$cpu" | grep -qE '^[0-9]+\\.?[0-9]*$'; then
-                                # 使用 awk 進行浮點數加法
-                                if [ -z "$total_cpu" ] || [ "$total_cpu" = "0" ]; then
-                                    total_cpu="$cpu"
-                                else
-                                    total_cpu=$(echo "$total_cpu $cpu" | awk '{{printf "%.2f", $1 + $2}}' 2>/dev/null)
-                                fi
-                                if [ $? -eq 0 ] && [ -n "$total_cpu" ]; then
-                                    cpu_count=$((cpu_count + 1))
-                                fi
-                            fi
-                        fi
-                    fi
-                done
-            fi
-            
-            if [ $cpu_count -gt 0 ] && [ -n "$total_cpu" ] && [ "$total_cpu" != "0" ]; then
-                echo "$total_cpu"
-            else
-                echo "0"
-            fi
-        else
-            echo "0"
-        fi
-        sleep 1
-    done
-) > "$CPU_LOG" 2>&1 &
-CPU_PID=$!
-
-# IO 監控進程 - 監控特定進程的 IO 速度（使用 pidstat -d）
-(
-    while true; do
-        pids=$(get_process_pids)
-        if [ -n "$pids" ]; then
-            total_io_kb=0
-            
-            # 優先使用 pidstat -d 監控 IO（更準確且支持跨用戶進程）
-            if command -v pidstat >/dev/null 2>&1; then
-                for pid in $pids; do
-                    if [ -d "/proc/$pid" ]; then
-                        # pidstat -d 顯示 IO 統計，1 1 表示監控1秒，輸出1次
-                        pidstat_output=$(pidstat -d -p $pid 1 1 2>/dev/null)
-                        if [ -n "$pidstat_output" ]; then
-                            # 找到數據行（跳過標題行，通常是前3行）
-                            io_line=$(echo "$pidstat_output" | tail -n +4 | grep "^[[:space:]]*$pid[[:space:]]" | head -1)
-                            if [ -z "$io_line" ]; then
-                                # 如果沒找到，嘗試最後一行（可能是數據行）
-                                io_line=$(echo "$pidstat_output" | tail -1)
-                            fi
-                            if [ -n "$io_line" ] && ! echo "$io_line" | grep -qE '^[[:space:]]*PID|Linux|^$'; then
-                                # 讀取 kB_rd/s (第5列) 和 kB_wr/s (第6列)，單位是 kB/s
-                                read_kb=$(echo "$io_line" | awk '{{print $5}}' 2>/dev/null)
-                                write_kb=$(echo "$io_line" | awk '{{print $6}}' 2>/dev/null)
-                                
-                                # 驗證並累加讀取速度
-                                if [ -n "$read_kb" ] && echo "$read_kb" | grep -qE '^[0-9]+\\.?[0-9]*$'; then
-                                    total_io_kb=$(echo "$total_io_kb $read_kb" | awk '{{printf "%.0f", $1 + $2}}' 2>/dev/null)
-                                fi
-                                
-                                # 驗證並累加寫入速度
-                                if [ -n "$write_kb" ] && echo "$write_kb" | grep -qE '^[0-9]+\\.?[0-9]*$'; then
-                                    total_io_kb=$(echo "$total_io_kb $write_kb" | awk '{{printf "%.0f", $1 + $2}}' 2>/dev/null)
-                                fi
-                            fi
-                        fi
-                    fi
-                done
-                
-                # pidstat 已經給出 kB/s，直接輸出
-                if [ -n "$total_io_kb" ] && [ "$total_io_kb" != "0" ]; then
-                    echo "$total_io_kb"
-                else
-                    echo "0"
-                fi
-            else
-                # 備用方案：使用 /proc/PID/io（需要 root 權限或進程屬於同一用戶）
-                prev_total_read=0
-                prev_total_write=0
-                first_read=true
-                
-                curr_total_read=0
-                curr_total_write=0
-                
-                for pid in $pids; do
-                    if [ -f "/proc/$pid/io" ]; then
-                        # 嘗試使用 sudo 讀取（如果可用）
-                        read_bytes=$(sudo cat /proc/$pid/io 2>/dev/null | grep "^read_bytes:" | awk '{{print $2}}')
-                        write_bytes=$(sudo cat /proc/$pid/io 2>/dev/null | grep "^write_bytes:" | awk '{{print $2}}')
-                        if [ -z "$read_bytes" ]; then
-                            # 如果 sudo 失敗，嘗試直接讀取
-                            read_bytes=$(grep "^read_bytes:" /proc/$pid/io 2>/dev/null | awk '{{print $2}}')
-                            write_bytes=$(grep "^write_bytes:" /proc/$pid/io 2>/dev/null | awk '{{print $2}}')
-                        fi
-                        if [ -n "$read_bytes" ] && echo "$read_bytes" | grep -qE '^[0-9]+$'; then
-                            curr_total_read=$((curr_total_read + read_bytes))
-                        fi
-                        if [ -n "$write_bytes" ] && echo "$write_bytes" | grep -qE '^[0-9]+$'; then
-                            curr_total_write=$((curr_total_write + write_bytes))
-                        fi
-                    fi
-                done
-                
-                if [ "$first_read" = "true" ]; then
-                    prev_total_read=$curr_total_read
-                    prev_total_write=$curr_total_write
-                    first_read=false
-                    echo "0"
-                else
-                    if [ $curr_total_read -ge $prev_total_read ] && [ $curr_total_write -ge $prev_total_write ]; then
-                        read_diff=$((curr_total_read - prev_total_read))
-                        write_diff=$((curr_total_write - prev_total_write))
-                        total_diff=$((read_diff + write_diff))
-                        
-                        if [ $total_diff -gt 0 ]; then
-                            io_kb=$(echo "scale=0; $total_diff / 1024" | bc 2>/dev/null)
-                            if [ -z "$io_kb" ] || [ "$io_kb" = "" ]; then
-                                io_kb=$((total_diff / 1024))
-                            fi
-                            echo "$io_kb"
-                        else
-                            echo "0"
-                        fi
-                        
-                        prev_total_read=$curr_total_read
-                        prev_total_write=$curr_total_write
-                    else
-                        prev_total_read=$curr_total_read
-                        prev_total_write=$curr_total_write
-                        echo "0"
-                    fi
-                fi
-            fi
-        else
-            # 進程不存在
-            echo "0"
-        fi
-        sleep 1
-    done
-) > "$IO_LOG" 2>&1 &
-IO_PID=$!
-
-echo $CPU_PID
-echo $IO_PID
-echo "$CPU_LOG"
-echo "$IO_LOG"
-""".format(PROCESS_NAME=process_name)
-        
-        # 上傳並執行監控腳本
-        # 使用 'EOF' 防止 bash 變量被解釋，但 PROCESS_NAME 已經在 Python 中替換了
-        monitor_setup = self.execute_command(
-            f"cat > /tmp/start_monitor.sh << 'MONITOR_EOF'\n{monitor_script}\nMONITOR_EOF\nchmod +x /tmp/start_monitor.sh"
-        )
-        monitor_output, _, _ = self.execute_command("/tmp/start_monitor.sh")
-        monitor_lines = monitor_output.strip().split('\n')
-        cpu_pid = monitor_lines[0] if len(monitor_lines) > 0 else ""
-        io_pid = monitor_lines[1] if len(monitor_lines) > 1 else ""
-        cpu_log_file = monitor_lines[2] if len(monitor_lines) > 2 else "/tmp/cpu_monitor.log"
-        io_log_file = monitor_lines[3] if len(monitor_lines) > 3 else "/tmp/io_monitor.log"
-        
-        # 等待一小段時間讓監控進程啟動
-        time.sleep(0.5)
-        
-        # 記錄開始時間和初始 CPU
+
+        # 啟動串流式監控：獨立 channel 每秒回傳採樣，本地執行緒即時累計
+        monitor = RemoteProcessMonitor(self.ssh_client, process_name)
+
+        # 等遠端採樣腳本真的開始輸出，而不是固定睡 0.5 秒
+        monitor.wait_started()
+
+        # 記錄開始時間（起訖 CPU 改從監控採樣取，不再多打兩趟 SSH）
         start_time = time.time()
-        start_cpu = self.get_cpu_usage()
-        
+
         # 執行主要命令（如果是 sudo 命令，使用 execute_sudo_command）
+        # 備份/還原等長命令使用獨立 channel，讓監控可以同時在持久 shell 上跑
         if command.strip().startswith('sudo'):
-            stdout, stderr, exit_code = self.execute_sudo_command(command, timeout=3600)
+            stdout, stderr, exit_code = self.execute_sudo_command(command, timeout=3600,
+                                                                  persistent=False)
         else:
-            stdout, stderr, exit_code = self.execute_command(command, timeout=3600)
-        
-        # 等待一小段時間確保最後的監控數據被記錄
-        time.sleep(1)
-        
-        # 停止監控進程
-        if cpu_pid:
-            self.execute_command(f"kill {cpu_pid} 2>/dev/null; wait {cpu_pid} 2>/dev/null")
-        if io_pid:
-            self.execute_command(f"kill {io_pid} 2>/dev/null; wait {io_pid} 2>/dev/null")
-        
-        # 計算執行時間
+            stdout, stderr, exit_code = self.execute_command(command, timeout=3600,
+                                                             persistent=False)
+
+        # 計算執行時間（在停止監控前計時，避免把收尾動作算進去）
         end_time = time.time()
         elapsed_time = end_time - start_time
-        
-        # 讀取 CPU 監控數據（平均值和峰值）
-        cpu_avg_cmd = f"cat {cpu_log_file} 2>/dev/null | awk '{{sum+=$1; count++}} END {{if(count>0) print sum/count; else print 0}}'"
-        cpu_max_cmd = f"cat {cpu_log_file} 2>/dev/null | awk '{{if($1>max || max==\"\") max=$1}} END {{print max+0}}'"
-        
-        cpu_avg_stdout, _, _ = self.execute_command(cpu_avg_cmd)
-        cpu_max_stdout, _, _ = self.execute_command(cpu_max_cmd)
-        
-        try:
-            avg_cpu = float(cpu_avg_stdout.strip())
-        except:
-            avg_cpu = 0.0
-        
-        try:
-            max_cpu = float(cpu_max_stdout.strip())
-        except:
-            max_cpu = avg_cpu
-        
-        # 讀取 IO 監控數據（平均值和峰值，單位 kB/s）
-        io_avg_cmd = f"cat {io_log_file} 2>/dev/null | awk '{{sum+=$1; count++}} END {{if(count>0) print sum/count; else print 0}}'"
-        io_max_cmd = f"cat {io_log_file} 2>/dev/null | awk '{{if($1>max || max==\"\") max=$1}} END {{print max+0}}'"
-        
-        io_avg_stdout, _, _ = self.execute_command(io_avg_cmd)
-        io_max_stdout, _, _ = self.execute_command(io_max_cmd)
-        
-        try:
-            avg_io_kb = float(io_avg_stdout.strip())
-        except:
-            avg_io_kb = 0.0
-        
-        try:
-            max_io_kb = float(io_max_stdout.strip())
-        except:
-            max_io_kb = avg_io_kb
-        
+
+        # 等待一小段時間確保最後的採樣被收到，再停止監控
+        time.sleep(1)
+        stats = monitor.stop()
+        avg_cpu = stats['avg_cpu']
+        max_cpu = stats['max_cpu']
+        avg_io_kb = stats['avg_io_kb']
+        max_io_kb = stats['max_io_kb']
+
         # 轉換為 MB/s 以便閱讀
         avg_io_mb = avg_io_kb / 1024.0
         max_io_mb = max_io_kb / 1024.0
-        
-        # 清理臨時檔案
-        self.execute_command(f"rm -f {cpu_log_file} {io_log_file} /tmp/start_monitor.sh /tmp/target_pids_*.txt 2>/dev/null")
-        
-        end_cpu = self.get_cpu_usage()
-        
+
+        # 起訖 CPU 直接取監控的第一個非零採樣與最後一個採樣
+        samples = monitor.cpu_samples
+        start_cpu = next((s for s in samples if s > 0), 0.0)
+        end_cpu = samples[-1] if samples else 0.0
+
         result = {
             'description': description,
             'elapsed_time_seconds': elapsed_time,
-            'elapsed_time_formatted': f"{int(elapsed_time // 60)}分{int(elapsed_time % 60)}秒",
+            'elapsed_time_formatted': _fmt_elapsed(elapsed_time),
             'start_cpu': start_cpu,
             'end_cpu': end_cpu,
             'avg_cpu': avg_cpu,
@@ -529,8 +780,9 @@ echo "$IO_LOG"
             'avg_io_mb': avg_io_mb,
             'max_io_mb': max_io_mb,
             'exit_code': exit_code,
-            'stdout': stdout[:500] if stdout else "",  # 只保留前500字元
-            'stderr': stderr[:500] if stderr else ""
+            # execute_command 已只保留尾端 500 字元，直接存
+            'stdout': stdout or "",
+            'stderr': stderr or ""
         }
         
         if exit_code == 0:
@@ -561,24 +813,32 @@ echo "$IO_LOG"
             'steps': []
         }
         
-        # 步驟 1: 資料填充
+        # 步驟 1: 資料填充（新版 pgbench 在伺服器端產生資料，舊版照舊）
         print("\n[步驟 1/6] 資料填充...")
+        if self._pgbench_server_side_generate():
+            fill_cmd = f"sudo -u postgres pgbench -i -I dtGvp -s {scale_factor} -p 5433 postgres"
+        else:
+            fill_cmd = f"sudo -u postgres pgbench -i -s {scale_factor} -p 5433 postgres"
         fill_result = self.monitor_command_with_cpu(
-            f"sudo -u postgres pgbench -i -s {scale_factor} -p 5433 postgres",
+            fill_cmd,
             f"資料填充 ({target_size})"
         )
         test_result['steps'].append(fill_result)
-        time.sleep(2)
-        
+        if fill_result['exit_code'] != 0:
+            # 填充失敗就中止本輪：繼續跑只會把殘留的舊資料備份起來，
+            # 整份量測結果都會是錯的
+            print(f"✗ 資料填充失敗，中止 {target_size} 測試")
+            test_result['error'] = '資料填充失敗'
+            return self._record_result(test_result)
+
         # 步驟 2: 記錄資料量大小
         print("\n[步驟 2/6] 記錄資料量大小...")
         size_stdout, size_stderr, size_exit = self.execute_sudo_command(
-            "-u postgres psql -p 5433 -c \"SELECT pg_size_pretty(pg_database_size('postgres'));\""
+            "-u postgres psql -tAq -p 5433 -c \"SELECT pg_size_pretty(pg_database_size('postgres'));\""
         )
         if size_exit == 0:
-            # 提取資料庫大小
-            size_match = re.search(r'(\d+\.?\d*\s*\w+)', size_stdout)
-            db_size = size_match.group(1) if size_match else "未知"
+            # -tAq 只輸出大小本身（例如 "123 MB"），不需再用正則提取
+            db_size = size_stdout.strip() or "未知"
             print(f"✓ 資料庫大小: {db_size}")
             test_result['database_size'] = db_size
         else:
@@ -589,10 +849,14 @@ echo "$IO_LOG"
         print("\n[步驟 3/6] 執行備份...")
         # 構建備份命令，如果有 process_max 或 archive_timeout 參數則添加
         backup_cmd = "sudo -u postgres pgbackrest --stanza=test-backup --type=full"
-        if self.process_max:
-            backup_cmd += f" --process-max={self.process_max}"
+        backup_cmd += f" --process-max={self._effective_process_max()}"
         if self.archive_timeout:
             backup_cmd += f" --archive-timeout={self.archive_timeout}"
+        # 壓縮是備份的 CPU 瓶頸，lz4 / zst 比預設 gzip 快數倍
+        if self.compress_type:
+            backup_cmd += f" --compress-type={self.compress_type}"
+            if self.compress_level is not None:
+                backup_cmd += f" --compress-level={self.compress_level}"
         backup_cmd += " backup"
         
         backup_result = self.monitor_command_with_cpu(
@@ -605,34 +869,44 @@ echo "$IO_LOG"
         test_result['backup_max_cpu'] = backup_result['max_cpu']
         test_result['backup_avg_io_mb'] = backup_result['avg_io_mb']
         test_result['backup_max_io_mb'] = backup_result['max_io_mb']
-        time.sleep(2)
-        
-        # 步驟 4: 停止 PostgreSQL
+
+        # 步驟 4 + 5: 停止 PostgreSQL 並刪除資料目錄
+        # 兩步相鄰且都不需要 CPU 監控，合併成一次 SSH 往返
         print("\n[步驟 4/6] 停止 PostgreSQL...")
-        stop_stdout, stop_stderr, stop_exit = self.execute_sudo_command(
-            "systemctl stop postgresql@16-test"
-        )
-        if stop_exit == 0:
+        print("[步驟 5/6] 刪除資料目錄...")
+        try:
+            markers = self.run_remote_script(
+                'systemctl stop postgresql@16-test; echo "###STOP_RC### $?"; '
+                'rm -rf /var/lib/postgresql/16/test/*; echo "###DELETE_RC### $?"',
+                sudo=True
+            )
+        except TimeoutError:
+            # 大型 shutdown checkpoint 可能超時：比照填充失敗，記錄後
+            # 中止本輪，不讓例外往外炸掉剩下的測試項目與報告
+            print(f"✗ 停止 / 刪除步驟逾時，中止 {target_size} 測試")
+            test_result['error'] = '停止/刪除資料目錄逾時'
+            return self._record_result(test_result)
+        if markers.get('STOP_RC') == '0':
             print("✓ PostgreSQL 已停止")
         else:
-            print(f"✗ 停止 PostgreSQL 失敗: {stop_stderr[:200]}")
-        time.sleep(2)
-        
-        # 步驟 5: 刪除資料目錄
-        print("\n[步驟 5/6] 刪除資料目錄...")
-        delete_stdout, delete_stderr, delete_exit = self.execute_sudo_command(
-            "bash -c 'rm -rf /var/lib/postgresql/16/test/*'"
-        )
-        if delete_exit == 0:
+            print(f"✗ 停止 PostgreSQL 失敗 (rc={markers.get('STOP_RC', '?')})")
+        if markers.get('DELETE_RC') == '0':
             print("✓ 資料目錄已刪除")
         else:
-            print(f"✗ 刪除資料目錄失敗: {delete_stderr[:200]}")
-        time.sleep(2)
-        
+            print(f"✗ 刪除資料目錄失敗 (rc={markers.get('DELETE_RC', '?')})")
+        # 確認服務真的停了再進行還原，不用固定等待
+        if not self._wait_until("! systemctl is-active --quiet postgresql@16-test"):
+            print("⚠ PostgreSQL 停止狀態確認逾時")
+
         # 步驟 6: 還原（計時與 CPU 使用率）
         print("\n[步驟 6/6] 執行還原...")
+        # 還原和備份一樣可以並行，比照 backup_cmd 帶上 process-max
+        restore_cmd = "sudo -u postgres pgbackrest --stanza=test-backup"
+        restore_cmd += f" --process-max={self._effective_process_max()}"
+        restore_cmd += " restore"
+
         restore_result = self.monitor_command_with_cpu(
-            "sudo -u postgres pgbackrest --stanza=test-backup restore",
+            restore_cmd,
             f"還原 ({target_size})"
         )
         test_result['steps'].append(restore_result)
@@ -641,119 +915,174 @@ echo "$IO_LOG"
         test_result['restore_max_cpu'] = restore_result['max_cpu']
         test_result['restore_avg_io_mb'] = restore_result['avg_io_mb']
         test_result['restore_max_io_mb'] = restore_result['max_io_mb']
-        
+    
         # 重新啟動 PostgreSQL（如果需要）
         print("\n重新啟動 PostgreSQL...")
         start_stdout, start_stderr, start_exit = self.execute_sudo_command(
             "systemctl start postgresql@16-test"
         )
         if start_exit == 0:
-            print("✓ PostgreSQL 已啟動")
-            time.sleep(5)  # 等待服務啟動
+            # 等到真的能接受連線為止，而不是固定睡 5 秒
+            if self._wait_until("pg_isready -p 5433 -q"):
+                print("✓ PostgreSQL 已啟動")
+            else:
+                print("⚠ PostgreSQL 啟動後未在時限內就緒")
         else:
             print(f"✗ 啟動 PostgreSQL 失敗: {start_stderr[:200]}")
-        
+
+        return self._record_result(test_result)
+
+    def _record_result(self, test_result: Dict) -> Dict:
+        """記錄一筆測試結果並即時落盤：報告可以事後從 JSONL 重建"""
         self.results.append(test_result)
+        try:
+            with open(self._jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(_dump_json(test_result) + '\n')
+        except OSError as e:
+            print(f"⚠ 無法寫入 {self._jsonl_path}: {e}")
         return test_result
-    
-    def generate_report(self, output_file: str = "test_results.json"):
+
+    def generate_report(self, output_file: str = None):
         """
         生成測試報告
         """
-        # 保存 JSON 報告
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(self.results, f, ensure_ascii=False, indent=2)
-        
-        # 生成文字報告
+        output_file = output_file or self.output_file
+
+        # 本輪沒有結果時，從 JSONL 載回先前完成的測試（續跑支援）
+        if not self.results and os.path.exists(self._jsonl_path):
+            with open(self._jsonl_path, 'r', encoding='utf-8') as f:
+                self.results = [json.loads(line) for line in f if line.strip()]
+
+        # 結果沒變就不重寫：報告第一行存結果的雜湊值，重跑時先比對
         report_file = output_file.replace('.json', '_report.txt')
-        with open(report_file, 'w', encoding='utf-8') as f:
-            f.write("="*80 + "\n")
-            f.write("PostgreSQL 備份還原測試報告\n")
-            f.write("="*80 + "\n\n")
-            
-            # 顯示系統 CPU 規格資訊
-            if self.cpu_info:
-                f.write("系統資訊:\n")
-                f.write(f"  CPU 型號: {self.cpu_info.get('model_name', '未知')}\n")
-                f.write(f"  物理 CPU 核心數: {self.cpu_info.get('cpu_cores', '未知')}\n")
-                f.write(f"  邏輯 CPU 數: {self.cpu_info.get('logical_cpus', '未知')}\n")
-                if isinstance(self.cpu_info.get('cpu_cores'), int) and isinstance(self.cpu_info.get('logical_cpus'), int):
-                    cpu_cores = self.cpu_info['cpu_cores']
-                    logical_cpus = self.cpu_info['logical_cpus']
-                    if logical_cpus > 0:
-                        max_cpu_percent = (cpu_cores * 100)
-                        f.write(f"  最大 CPU 使用率（相對於物理核心）: {max_cpu_percent}%\n")
-                f.write("\n")
-            
-            for result in self.results:
-                f.write(f"\n{'='*80}\n")
-                f.write(f"測試項目: {result['target_size']}\n")
-                f.write(f"Scale Factor: {result['scale_factor']}\n")
-                f.write(f"資料庫大小: {result.get('database_size', '未知')}\n")
-                f.write(f"測試時間: {result['timestamp']}\n")
-                f.write(f"{'='*80}\n\n")
-                
-                f.write("備份階段:\n")
-                f.write(f"  耗時: {result.get('backup_time', 0):.2f} 秒\n")
-                backup_avg_cpu = result.get('backup_avg_cpu', 0)
-                backup_max_cpu = result.get('backup_max_cpu', 0)
-                f.write(f"  平均 CPU 使用率: {backup_avg_cpu:.2f}%")
-                if isinstance(self.cpu_info.get('cpu_cores'), int) and self.cpu_info['cpu_cores'] > 0:
-                    backup_avg_cpu_relative = (backup_avg_cpu / (self.cpu_info['cpu_cores'] * 100)) * 100
-                    f.write(f" (相對於物理核心: {backup_avg_cpu_relative:.2f}%)")
-                f.write("\n")
-                f.write(f"  峰值 CPU 使用率: {backup_max_cpu:.2f}%")
-                if isinstance(self.cpu_info.get('cpu_cores'), int) and self.cpu_info['cpu_cores'] > 0:
-                    backup_max_cpu_relative = (backup_max_cpu / (self.cpu_info['cpu_cores'] * 100)) * 100
-                    f.write(f" (相對於物理核心: {backup_max_cpu_relative:.2f}%)")
-                f.write("\n")
-                f.write(f"  平均 IO 速度: {result.get('backup_avg_io_mb', 0):.2f} MB/s\n")
-                f.write(f"  峰值 IO 速度: {result.get('backup_max_io_mb', 0):.2f} MB/s\n\n")
-                
-                f.write("還原階段:\n")
-                f.write(f"  耗時: {result.get('restore_time', 0):.2f} 秒\n")
-                restore_avg_cpu = result.get('restore_avg_cpu', 0)
-                restore_max_cpu = result.get('restore_max_cpu', 0)
-                f.write(f"  平均 CPU 使用率: {restore_avg_cpu:.2f}%")
-                if isinstance(self.cpu_info.get('cpu_cores'), int) and self.cpu_info['cpu_cores'] > 0:
-                    restore_avg_cpu_relative = (restore_avg_cpu / (self.cpu_info['cpu_cores'] * 100)) * 100
-                    f.write(f" (相對於物理核心: {restore_avg_cpu_relative:.2f}%)")
-                f.write("\n")
-                f.write(f"  峰值 CPU 使用率: {restore_max_cpu:.2f}%")
-                if isinstance(self.cpu_info.get('cpu_cores'), int) and self.cpu_info['cpu_cores'] > 0:
-                    restore_max_cpu_relative = (restore_max_cpu / (self.cpu_info['cpu_cores'] * 100)) * 100
-                    f.write(f" (相對於物理核心: {restore_max_cpu_relative:.2f}%)")
-                f.write("\n")
-                f.write(f"  平均 IO 速度: {result.get('restore_avg_io_mb', 0):.2f} MB/s\n")
-                f.write(f"  峰值 IO 速度: {result.get('restore_max_io_mb', 0):.2f} MB/s\n\n")
-            
-            # 總結表格
-            f.write("\n" + "="*80 + "\n")
-            f.write("測試總結\n")
-            f.write("="*80 + "\n")
-            f.write(f"{'資料大小':<12} {'資料庫大小':<12} {'備份時間(秒)':<14} {'備份CPU平均(%)':<16} {'備份CPU峰值(%)':<16} {'備份IO平均(MB/s)':<18} {'備份IO峰值(MB/s)':<18} {'還原時間(秒)':<14} {'還原CPU平均(%)':<16} {'還原CPU峰值(%)':<16} {'還原IO平均(MB/s)':<18} {'還原IO峰值(MB/s)':<18}\n")
-            f.write("-"*200 + "\n")
-            
-            for result in self.results:
-                f.write(f"{result['target_size']:<12} "
-                       f"{result.get('database_size', 'N/A'):<12} "
-                       f"{result.get('backup_time', 0):<14.2f} "
-                       f"{result.get('backup_avg_cpu', 0):<16.2f} "
-                       f"{result.get('backup_max_cpu', 0):<16.2f} "
-                       f"{result.get('backup_avg_io_mb', 0):<18.2f} "
-                       f"{result.get('backup_max_io_mb', 0):<18.2f} "
-                       f"{result.get('restore_time', 0):<14.2f} "
-                       f"{result.get('restore_avg_cpu', 0):<16.2f} "
-                       f"{result.get('restore_max_cpu', 0):<16.2f} "
-                       f"{result.get('restore_avg_io_mb', 0):<18.2f} "
-                       f"{result.get('restore_max_io_mb', 0):<18.2f}\n")
-        
+        results_hash = hashlib.sha256(
+            json.dumps(self.results, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+        hash_line = f"# hash: {results_hash}\n"
+        if os.path.exists(report_file):
+            try:
+                with open(report_file, 'r', encoding='utf-8') as f:
+                    if f.readline() == hash_line:
+                        print(f"\n✓ 測試結果未變，沿用既有報告:")
+                        print(f"  - JSON: {output_file}")
+                        print(f"  - 文字報告: {report_file}")
+                        return
+            except OSError:
+                pass
+
+        # 保存 JSON 報告（一次寫出整份序列化結果）
+        with open(output_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.write(_dump_json(self.results, indent=True))
+
+        # 生成文字報告：內容先累積在 list，最後一次寫出，
+        # 避免幾十次小 f.write 各付一次呼叫 / 系統呼叫成本
+        parts = []
+        parts.append(hash_line)
+        parts.append("="*80 + "\n")
+        parts.append("PostgreSQL 備份還原測試報告\n")
+        parts.append("="*80 + "\n\n")
+
+        # 顯示系統 CPU 規格資訊
+        if self.cpu_info:
+            parts.append("系統資訊:\n")
+            parts.append(f"  CPU 型號: {self.cpu_info.get('model_name', '未知')}\n")
+            parts.append(f"  物理 CPU 核心數: {self.cpu_info.get('cpu_cores', '未知')}\n")
+            parts.append(f"  邏輯 CPU 數: {self.cpu_info.get('logical_cpus', '未知')}\n")
+            if isinstance(self.cpu_info.get('cpu_cores'), int) and isinstance(self.cpu_info.get('logical_cpus'), int):
+                cpu_cores = self.cpu_info['cpu_cores']
+                logical_cpus = self.cpu_info['logical_cpus']
+                if logical_cpus > 0:
+                    max_cpu_percent = (cpu_cores * 100)
+                    parts.append(f"  最大 CPU 使用率（相對於物理核心）: {max_cpu_percent}%\n")
+            parts.append("\n")
+
+        # 迴圈內重複查的鍵提到區域變數，避免每列重複雜湊 / 屬性查找
+        cpu_cores = self.cpu_info.get('cpu_cores')
+        has_cores = isinstance(cpu_cores, int) and cpu_cores > 0
+        append = parts.append
+
+        for result in self.results:
+            get = result.get
+            append(f"\n{'='*80}\n")
+            append(f"測試項目: {result['target_size']}\n")
+            append(f"Scale Factor: {result['scale_factor']}\n")
+            append(f"資料庫大小: {get('database_size', '未知')}\n")
+            append(f"測試時間: {result['timestamp']}\n")
+            append(f"{'='*80}\n\n")
+
+            append("備份階段:\n")
+            append(f"  耗時: {get('backup_time', 0):.2f} 秒\n")
+            backup_avg_cpu = get('backup_avg_cpu', 0)
+            backup_max_cpu = get('backup_max_cpu', 0)
+            append(f"  平均 CPU 使用率: {backup_avg_cpu:.2f}%")
+            if has_cores:
+                backup_avg_cpu_relative = (backup_avg_cpu / (cpu_cores * 100)) * 100
+                append(f" (相對於物理核心: {backup_avg_cpu_relative:.2f}%)")
+            append("\n")
+            append(f"  峰值 CPU 使用率: {backup_max_cpu:.2f}%")
+            if has_cores:
+                backup_max_cpu_relative = (backup_max_cpu / (cpu_cores * 100)) * 100
+                append(f" (相對於物理核心: {backup_max_cpu_relative:.2f}%)")
+            append("\n")
+            append(f"  平均 IO 速度: {get('backup_avg_io_mb', 0):.2f} MB/s\n")
+            append(f"  峰值 IO 速度: {get('backup_max_io_mb', 0):.2f} MB/s\n\n")
+
+            append("還原階段:\n")
+            append(f"  耗時: {get('restore_time', 0):.2f} 秒\n")
+            restore_avg_cpu = get('restore_avg_cpu', 0)
+            restore_max_cpu = get('restore_max_cpu', 0)
+            append(f"  平均 CPU 使用率: {restore_avg_cpu:.2f}%")
+            if has_cores:
+                restore_avg_cpu_relative = (restore_avg_cpu / (cpu_cores * 100)) * 100
+                append(f" (相對於物理核心: {restore_avg_cpu_relative:.2f}%)")
+            append("\n")
+            append(f"  峰值 CPU 使用率: {restore_max_cpu:.2f}%")
+            if has_cores:
+                restore_max_cpu_relative = (restore_max_cpu / (cpu_cores * 100)) * 100
+                append(f" (相對於物理核心: {restore_max_cpu_relative:.2f}%)")
+            append("\n")
+            append(f"  平均 IO 速度: {get('restore_avg_io_mb', 0):.2f} MB/s\n")
+            append(f"  峰值 IO 速度: {get('restore_max_io_mb', 0):.2f} MB/s\n\n")
+
+        # 總結表格
+        parts.append("\n" + "="*80 + "\n")
+        parts.append("測試總結\n")
+        parts.append("="*80 + "\n")
+        parts.append(_HEADER)
+        parts.append("-"*200 + "\n")
+
+        for result in self.results:
+            get = result.get
+            append(_ROW_FMT.format(
+                result['target_size'],
+                get('database_size', 'N/A'),
+                get('backup_time', 0),
+                get('backup_avg_cpu', 0),
+                get('backup_max_cpu', 0),
+                get('backup_avg_io_mb', 0),
+                get('backup_max_io_mb', 0),
+                get('restore_time', 0),
+                get('restore_avg_cpu', 0),
+                get('restore_max_cpu', 0),
+                get('restore_avg_io_mb', 0),
+                get('restore_max_io_mb', 0)))
+
+        with open(report_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.write(''.join(parts))
+
         print(f"\n✓ 測試報告已生成:")
         print(f"  - JSON: {output_file}")
         print(f"  - 文字報告: {report_file}")
     
     def close(self):
         """關閉 SSH 連線"""
+        self._sudo_stop.set()
+        if self._shell_chan is not None:
+            try:
+                self._shell_chan.close()
+            except Exception:
+                pass
+            self._shell_chan = None
         if self.ssh_client:
             self.ssh_client.close()
             print("\n✓ SSH 連線已關閉")
@@ -784,6 +1113,14 @@ def main():
                        help='pgbackrest 最大進程數（用於並發備份，例如: 4）')
     parser.add_argument('--archive-timeout', type=int, default=None,
                        help='pgbackrest 歸檔超時時間（秒，例如: 300 表示 5 分鐘）')
+    parser.add_argument('--known-hosts', type=str, default=None,
+                       help='known_hosts 檔案路徑（提供時不自動接受未知主機金鑰）')
+    parser.add_argument('--compress-type', type=str, default=None,
+                       choices=['none', 'gz', 'bz2', 'lz4', 'zst'],
+                       help='pgbackrest 壓縮演算法（預設沿用 pgbackrest 設定檔；'
+                            'lz4 / zst 比 gzip 省很多 CPU）')
+    parser.add_argument('--compress-level', type=int, default=None,
+                       help='pgbackrest 壓縮等級（需搭配 --compress-type）')
     parser.add_argument('--config', type=str, default='config.json',
                        help='連線設定檔路徑（預設: config.json，如存在會覆蓋 --host/--user/--password/--port 等參數）')
     
@@ -800,26 +1137,31 @@ def main():
             config = {}
 
     # 如果設定檔有提供值，覆蓋 argparse 預設 / 命令列值
+    # 鍵表驅動：新增設定鍵時改這兩個 tuple 就好，不用再加 if 分支
     if isinstance(config, dict):
-        if 'host' in config and config['host']:
-            args.host = config['host']
-        if 'user' in config and config['user']:
-            args.user = config['user']
+        for key in _STR_KEYS:
+            if config.get(key):
+                setattr(args, key, config[key])
+        for key in _INT_KEYS:
+            value = config.get(key)
+            # port 維持原本的「非空才覆蓋」，其餘只略過 None
+            if value is None or (key == 'port' and not value):
+                continue
+            setattr(args, key, int(value))
         if 'password' in config:
             # 允許密碼為空字串，但如果 key 存在就以設定檔為準
             args.password = config['password']
-        if 'port' in config and config['port']:
-            args.port = int(config['port'])
-        if 'process_max' in config and config['process_max'] is not None:
-            args.process_max = int(config['process_max'])
-        if 'archive_timeout' in config and config['archive_timeout'] is not None:
-            args.archive_timeout = int(config['archive_timeout'])
     
     print("PostgreSQL 備份還原自動化測試")
     print("="*60)
     
     # 如果使用互動式模式，則提示輸入
     if args.interactive:
+        # CI / nohup 下 stdin 不是終端機，input() 只會在連線前掛死或丟 EOFError，
+        # 直接快速失敗
+        if not sys.stdin.isatty():
+            print("✗ --interactive 需要終端機（stdin 不是 TTY），請改用命令列參數或設定檔")
+            sys.exit(1)
         print("\n請輸入 SSH 連線資訊:")
         hostname = input(f"主機名稱或 IP [{args.host}]: ").strip() or args.host
         username = input(f"使用者名稱 [{args.user}]: ").strip() or args.user
@@ -842,10 +1184,10 @@ def main():
         password = args.password
         key_file = args.key_file
         
-        print(f"\n使用連線資訊:")
-        print(f"  主機: {hostname}")
-        print(f"  使用者: {username}")
-        print(f"  認證方式: {'金鑰檔案' if key_file else '密碼'}")
+        print("\n使用連線資訊:\n"
+              f"  主機: {hostname}\n"
+              f"  使用者: {username}\n"
+              f"  認證方式: {'金鑰檔案' if key_file else '密碼'}")
     
     # 建立自動化物件（sudo 密碼與 SSH 密碼相同）
     automation = PostgreSQLTestAutomation(
@@ -856,38 +1198,29 @@ def main():
         port=args.port,
         sudo_password=password,  # sudo 密碼與 SSH 密碼相同
         process_max=args.process_max,  # pgbackrest 最大進程數
-        archive_timeout=args.archive_timeout  # pgbackrest 歸檔超時時間
+        archive_timeout=args.archive_timeout,  # pgbackrest 歸檔超時時間
+        compress_type=args.compress_type,
+        compress_level=args.compress_level,
+        known_hosts=args.known_hosts
     )
     
-    # 顯示 pgbackrest 設定
+    # 顯示 pgbackrest 設定（先湊成多行再一次輸出）
+    settings = []
     if args.process_max:
-        print(f"pgbackrest 最大進程數: {args.process_max}")
+        settings.append(f"pgbackrest 最大進程數: {args.process_max}")
     if args.archive_timeout:
-        print(f"pgbackrest 歸檔超時時間: {args.archive_timeout} 秒 ({args.archive_timeout // 60} 分鐘)")
+        settings.append(f"pgbackrest 歸檔超時時間: {args.archive_timeout} 秒 ({args.archive_timeout // 60} 分鐘)")
+    if args.compress_type:
+        level_note = f" (等級 {args.compress_level})" if args.compress_level is not None else ""
+        settings.append(f"pgbackrest 壓縮演算法: {args.compress_type}{level_note}")
+    if settings:
+        print('\n'.join(settings))
     
     try:
         # 定義測試項目
         # 根據實際測試結果，每個 scale factor ≈ 15 MB
         # 因此調整 scale factor 以達到目標資料大小：目標大小(MB) ÷ 15 ≈ scale factor
-        
-        def parse_size(size_str: str) -> int:
-            """將大小字串（如 '1GB', '500MB'）轉換為 MB"""
-            size_str = size_str.strip().upper()
-            if size_str.endswith('GB'):
-                return int(float(size_str[:-2]) * 1024)
-            elif size_str.endswith('MB'):
-                return int(float(size_str[:-2]))
-            elif size_str.endswith('KB'):
-                return int(float(size_str[:-2]) / 1024)
-            else:
-                # 假設是數字，單位為 MB
-                return int(float(size_str))
-        
-        def calculate_scale_factor(target_mb: int) -> int:
-            """根據目標大小（MB）計算 scale factor"""
-            # 每個 scale factor ≈ 15 MB
-            return max(1, int(target_mb / 15))
-        
+
         # 處理用戶指定的資料大小
         if args.sizes:
             size_list = [s.strip() for s in args.sizes.split(',')]
@@ -895,25 +1228,29 @@ def main():
             for size_str in size_list:
                 target_mb = parse_size(size_str)
                 scale_factor = calculate_scale_factor(target_mb)
-                # 保持原始格式作為標籤
-                test_configs.append((scale_factor, size_str))
+                # 保持原始格式作為標籤，一併存下 target_mb 避免重複解析
+                test_configs.append((scale_factor, size_str, target_mb))
             print(f"\n使用自訂測試大小: {args.sizes}")
         else:
             # 預設測試項目
             test_configs = [
-                (68, "1GB"),
-                (205, "3GB"),
-                (341, "5GB"),
-                (614, "9GB")
+                (68, "1GB", 1024),
+                (205, "3GB", 3072),
+                (341, "5GB", 5120),
+                (614, "9GB", 9216)
             ]
             print(f"\n使用預設測試大小: 1GB, 3GB, 5GB, 9GB")
-        
-        print(f"將執行 {len(test_configs)} 個測試項目...")
-        for scale_factor, target_size in test_configs:
-            target_mb = parse_size(target_size)
-            print(f"  - {target_size} (scale factor: {scale_factor}, 預期約 {target_mb} MB)")
+
+        print('\n'.join(
+            [f"將執行 {len(test_configs)} 個測試項目..."] +
+            [f"  - {target_size} (scale factor: {scale_factor}, 預期約 {target_mb} MB)"
+             for scale_factor, target_size, target_mb in test_configs]))
         
         if not args.auto_start:
+            if not sys.stdin.isatty():
+                # 沒有人能回答確認提示：保守地取消而不是掛在 input() 上
+                print("stdin 不是 TTY，無法確認是否繼續，已取消（或改用 --auto-start）")
+                return
             confirm = input("是否繼續? (y/n): ").strip().lower()
             if confirm != 'y':
                 print("已取消")
@@ -922,9 +1259,10 @@ def main():
             print("自動開始測試...")
         
         # 執行測試
-        for scale_factor, target_size in test_configs:
+        for scale_factor, target_size, _ in test_configs:
             automation.run_test_sequence(scale_factor, target_size)
-            time.sleep(5)  # 測試間隔
+            # 測試間隔：等資料庫可連線即可，不再固定睡 5 秒
+            automation._wait_until("pg_isready -p 5433 -q", timeout=5)
         
         # 生成報告
         automation.generate_report()
@@ -933,7 +1271,6 @@ def main():
         print("\n\n測試被使用者中斷")
     except Exception as e:
         print(f"\n✗ 發生錯誤: {e}")
-        import traceback
         traceback.print_exc()
     finally:
         automation.close()